@@ -1,18 +1,156 @@
-import random
-import re
 import string
 
 import numpy as np
+from numba import njit, prange
+
+
+@njit(cache=True, fastmath=True)
+def _transposition_delta(perm, r1, r2, bigram_counts, log_emp):
+    """Score change from transposing perm[r1] and perm[r2]
+
+    The full score is sum(bigram_counts * log_emp[perm[x], perm[y]]) over all
+    bigrams (x, y). Swapping two entries of perm only changes terms in
+    rows/columns r1 and r2, so the delta sums 4 alphabet-sized slices instead
+    of rescoring the whole text.
+    """
+    p1, p2 = perm[r1], perm[r2]
+    delta = 0.0
+    for y in range(perm.shape[0]):
+        py = perm[y]
+        if y == r1:
+            new_py = p2
+        elif y == r2:
+            new_py = p1
+        else:
+            new_py = py
+        # rows r1 and r2: bigrams starting at encrypted symbols r1 and r2
+        delta += bigram_counts[r1, y] * (log_emp[p2, new_py] - log_emp[p1, py])
+        delta += bigram_counts[r2, y] * (log_emp[p1, new_py] - log_emp[p2, py])
+        # columns r1 and r2, skipping cells already covered by the rows above
+        if y != r1 and y != r2:
+            delta += bigram_counts[y, r1] * (log_emp[py, p2] - log_emp[py, p1])
+            delta += bigram_counts[y, r2] * (log_emp[py, p1] - log_emp[py, p2])
+    return delta
+
+
+@njit(cache=True, fastmath=True)
+def _mcmc_run(
+    bigram_counts, log_emp, perm, best_perm, current_score, best_score, iters, seed, proposals
+):
+    """Run iters multi-proposal Metropolis steps, mutating perm and best_perm
+    in place
+
+    Every step scores `proposals` random transpositions at once and samples
+    the next state among staying put and the proposed states, weighted by
+    their (shifted) probabilities. Returns the updated
+    (current_score, best_score) pair.
+    """
+    np.random.seed(seed)
+    n = perm.shape[0]
+    r1s = np.empty(proposals, dtype=np.int64)
+    r2s = np.empty(proposals, dtype=np.int64)
+    deltas = np.empty(proposals, dtype=np.float64)
+
+    # Total bigram mass touching each encrypted symbol: swapping two symbols
+    # that never occur in the text cannot change the score
+    involved = np.zeros(n, dtype=np.int64)
+    for a in range(n):
+        for b in range(n):
+            involved[a] += bigram_counts[a, b]
+            involved[b] += bigram_counts[a, b]
+
+    for _ in range(iters):
+        # Create proposals from f by random transpositions of 2 letters
+        for p in range(proposals):
+            r1 = np.random.randint(0, n)
+            r2 = np.random.randint(0, n)
+            r1s[p] = r1
+            r2s[p] = r2
+            if r1 == r2 or (involved[r1] == 0 and involved[r2] == 0):
+                deltas[p] = 0.0
+            else:
+                deltas[p] = _transposition_delta(perm, r1, r2, bigram_counts, log_emp)
+
+        # Shift weights by the largest delta so np.exp never overflows
+        shift = 0.0
+        for p in range(proposals):
+            if deltas[p] > shift:
+                shift = deltas[p]
+        total = np.exp(-shift)
+        for p in range(proposals):
+            total += np.exp(deltas[p] - shift)
+
+        # Sample next state: chosen == -1 keeps the current permutation
+        u = np.random.random() * total
+        acc = np.exp(-shift)
+        chosen = -1
+        p = 0
+        while u >= acc and p < proposals:
+            acc += np.exp(deltas[p] - shift)
+            chosen = p
+            p += 1
+
+        # Apply chosen swap in place, nothing to revert when staying put
+        if chosen >= 0:
+            r1, r2 = r1s[chosen], r2s[chosen]
+            perm[r1], perm[r2] = perm[r2], perm[r1]
+            current_score += deltas[chosen]
+
+            # best_score >= current_score always holds, so an improvement
+            # over the best is always an accepted proposal
+            if current_score > best_score:
+                best_score = current_score
+                best_perm[:] = perm
+    return current_score, best_score
+
+
+@njit(cache=True, parallel=True)
+def _mcmc_chains(
+    bigram_counts,
+    log_emp,
+    perms,
+    best_perms,
+    current_scores,
+    best_scores,
+    iters,
+    seeds,
+    proposals,
+):
+    """Advance independent MCMC chains in parallel, one per seeds entry
+
+    Each chain owns a row of perms/best_perms and an entry of the score
+    arrays; all state is updated in place.
+    """
+    for k in prange(seeds.shape[0]):
+        current_scores[k], best_scores[k] = _mcmc_run(
+            bigram_counts,
+            log_emp,
+            perms[k],
+            best_perms[k],
+            current_scores[k],
+            best_scores[k],
+            iters,
+            seeds[k],
+            proposals,
+        )
 
 
 class EnigmaForDummies:
-    def __init__(self) -> None:
+    def __init__(self, seed=None) -> None:
         self.emp_freq_prepared = False
-        self.regex_pattern = re.compile("[^a-z ]")
+        self.rng = np.random.default_rng(seed)
         self.alphabet = " " + string.ascii_lowercase
         self.char_index_mapping = dict(
             zip(list(self.alphabet), range(len(self.alphabet)))
         )
+        # byte value -> alphabet index lookup table, -1 for bytes outside [a-z ]
+        self.byte_index_lut = np.full(256, -1, dtype=np.int8)
+        for char, index in self.char_index_mapping.items():
+            self.byte_index_lut[ord(char)] = index
+        # bytes outside [a-z ], for bytes.translate-based text cleaning
+        self.non_alphabet_bytes = bytes(
+            i for i in range(256) if chr(i) not in self.char_index_mapping
+        )
 
     def encrypt_or_decrypt(self, text: str, mapping: dict) -> str:
         """Transform text using mapping dictionary
@@ -24,7 +162,19 @@ class EnigmaForDummies:
         Returns:
             str: transformed text
         """
-        return "".join([mapping[s] for s in text])
+        return text.translate(str.maketrans(mapping))
+
+    def clean_text(self, text: str) -> str:
+        """Drop every symbol outside the alphabet from lowercased text
+
+        Args:
+            text (str): text to clean
+
+        Returns:
+            str: text containing only lowercase letters and spaces
+        """
+        text_bytes = text.lower().encode("ascii", errors="ignore")
+        return text_bytes.translate(None, self.non_alphabet_bytes).decode("ascii")
 
     def prepare_empirical_freq_normalized(self, path_to_file: str) -> None:
         """Prepare dictionary of normalized empirical frequences from provided corpus
@@ -32,40 +182,45 @@ class EnigmaForDummies:
         Args:
             path_to_file (str): path to corpus text file
         """
-        # Dictionary to store bigram pairs counts
-        char_bigram_counts = {}
-
-        with open(path_to_file, encoding="utf-8") as f:
-            for line in f:
-                # pre-process line
-                clean_line = np.array(list(self.regex_pattern.sub("", line.lower())))
-
-                # create symbols transition array
-                transitions = clean_line.repeat(2)[1:-1].reshape(-1, 2)
-
-                # count every symbols transition met in line
-                for i, j in transitions:
-                    char_bigram_counts[(i, j)] = (
-                        char_bigram_counts.setdefault((i, j), 0) + 1
-                    )
-
-        # create letters encoder
-        letters = [" "] + list(string.ascii_lowercase)
-        unigram_to_index = dict(zip(letters, range(len(letters))))
-
-        # Create transition matrix
-        n = len(unigram_to_index)
-        transition_matrix = np.ones((n, n)) + 1
-
-        # fill in transition matrix for each pair
-        for s_pair in char_bigram_counts.keys():
-            transition_matrix[unigram_to_index[s_pair[0]]][
-                unigram_to_index[s_pair[1]]
-            ] = char_bigram_counts[s_pair]
+        # Flat buffer for bigram pairs counts, reshaped to a matrix at the end
+        n = len(self.alphabet)
+        flat_counts = np.zeros(n * n, dtype=np.int64)
+
+        with open(path_to_file, "rb") as f:
+            # last kept symbol of the previous chunk, carried over so bigrams
+            # spanning chunk boundaries are not lost
+            prev = np.empty(0, dtype=np.int32)
+            while chunk := f.read(1 << 20):
+                # lowercase the raw bytes and encode them into alphabet
+                # indices, dropping everything outside [a-z ] via the
+                # lookup table
+                idx = self.byte_index_lut[np.frombuffer(chunk.lower(), dtype=np.uint8)]
+                idx = np.concatenate((prev, idx[idx >= 0].astype(np.int32)))
+                if idx.size < 2:
+                    prev = idx
+                    continue
+
+                # count every symbols transition met in chunk: flatten bigram
+                # (a, b) to a * n + b and histogram in one bincount call
+                flat_counts += np.bincount(idx[:-1] * n + idx[1:], minlength=n * n)
+                prev = idx[-1:]
+
+        bigram_counts = flat_counts.reshape(n, n)
+
+        # Laplace smoothing: every bigram gets a pseudo-count of 2, so rare
+        # and never met bigrams never hit log(0)
+        bigram_counts += 2
 
         # normalize matrix rows
-        row_sums = transition_matrix.sum(axis=1)
-        self.empirical_frequences = transition_matrix / row_sums[:, np.newaxis]
+        row_sums = bigram_counts.sum(axis=1, keepdims=True)
+        self.empirical_frequences = bigram_counts / row_sums
+        # precompute logs once so scoring never calls np.log per bigram,
+        # plus a raveled copy for flat-index scoring. float32 is plenty:
+        # Metropolis acceptance only ever looks at score differences
+        self.log_empirical_frequences = np.log(self.empirical_frequences).astype(
+            np.float32
+        )
+        self.log_emp_flat = self.log_empirical_frequences.ravel()
         self.emp_freq_prepared = True
 
     def encrypt_text(self, text: str) -> str:
@@ -77,92 +232,142 @@ class EnigmaForDummies:
         Returns:
             str: encrypted text
         """
-        text_cleaned = self.regex_pattern.sub("", text.lower())
-        shuffled_alphabet = list(self.alphabet)
-        random.shuffle(shuffled_alphabet)
+        text_cleaned = self.clean_text(text)
+        shuffled_alphabet = self.rng.permutation(list(self.alphabet))
         random_cifer = dict(zip(list(self.alphabet), shuffled_alphabet))
         encrypted_text = self.encrypt_or_decrypt(text_cleaned, random_cifer)
         return encrypted_text
 
-    def score_cipher(self, cipher: dict, encrypted: str) -> float:
-        """Score current cipher given encrypted text. The higher score the better
+    def encode_text(self, text: str) -> np.ndarray:
+        """Encode text into an array of alphabet indices
 
         Args:
-            cipher (dict): proposed cipher to score
-            encrypted (str): encrypted text
+            text (str): text to encode
 
         Returns:
-            (float or str): cipher score or decrypted sample
+            np.ndarray: int8 array of alphabet indices
         """
-        decrypted = self.encrypt_or_decrypt(
-            encrypted, {v: k for k, v in cipher.items()}
-        )
+        return self.byte_index_lut[
+            np.frombuffer(text.encode("ascii"), dtype=np.uint8)
+        ]
+
+    def perm_to_mapping(self, perm: np.ndarray) -> dict:
+        """Convert an index permutation into a symbols mapping dictionary
 
-        score = 0
-        for i in range(len(decrypted) - 1):
-            first_symbol = self.char_index_mapping[decrypted[i]]
-            second_symbol = self.char_index_mapping[decrypted[i + 1]]
-            score += np.log(self.empirical_frequences[first_symbol][second_symbol])
+        Args:
+            perm (np.ndarray): encrypted->plain index permutation
+
+        Returns:
+            dict: mapping dictionary for symbols transformation
+        """
+        return {self.alphabet[i]: self.alphabet[j] for i, j in enumerate(perm)}
+
+    def score_cipher(self, perm: np.ndarray, enc_idx: np.ndarray) -> float:
+        """Score current cipher given encoded encrypted text. The higher score the better
+
+        Args:
+            perm (np.ndarray): proposed cipher as encrypted->plain index permutation
+            enc_idx (np.ndarray): encrypted text encoded as alphabet indices
+
+        Returns:
+            float: cipher score
+        """
+        n = len(self.alphabet)
+        decrypted = perm[enc_idx].astype(np.int32)
+        flat = decrypted[:-1] * n + decrypted[1:]
+        return np.take(self.log_emp_flat, flat).sum()
+
+    def count_bigrams(self, enc_idx: np.ndarray) -> np.ndarray:
+        """Count occurences of every bigram in encoded text
 
-        return score
+        Args:
+            enc_idx (np.ndarray): text encoded as alphabet indices
 
-    def process_decryption(self, encrypted: str, iters: int = 5000, verbose=500) -> str:
+        Returns:
+            np.ndarray: matrix of bigram counts indexed by alphabet indices
+        """
+        n = len(self.alphabet)
+        counts = np.zeros((n, n), dtype=np.int64)
+        np.add.at(counts, (enc_idx[:-1], enc_idx[1:]), 1)
+        return counts
+
+    def process_decryption(
+        self,
+        encrypted: str,
+        iters: int = 5000,
+        verbose=500,
+        chains: int = 8,
+        proposals: int = 16,
+    ) -> str:
         """Process text decryption using MCMC algorithm with random cipher permutations
 
         Args:
             encrypted (str): encrypted text
             iters (int, optional): _description_. Defaults to 5000.
             verbose (int, optional): _description_. Defaults to 500.
+            chains (int, optional): number of independent parallel chains,
+                the best scoring one wins. Defaults to 8.
+            proposals (int, optional): transpositions scored per MCMC step,
+                the next state is sampled among them. Defaults to 16.
 
         Returns:
             str: _description_
         """
         assert self.emp_freq_prepared, "Prepare empirical frequences first."
-        # Initialize with a random mapping
-        shuffled_letters = list(self.alphabet)
-        random.shuffle(shuffled_letters)
-        current_cifer = dict(zip(shuffled_letters, list(self.alphabet)))
-        current_score = self.score_cipher(current_cifer, encrypted)
-
-        best_cifer, best_score = current_cifer.copy(), current_score
-        for i in range(0, iters):
-            # Create proposal from f by random transposition of 2 letters
-            r1, r2 = np.random.choice(list(shuffled_letters), 2, replace=True)
-            new_cifer = current_cifer.copy()
-            new_cifer[r1] = current_cifer[r2]
-            new_cifer[r2] = current_cifer[r1]
-            new_score = self.score_cipher(new_cifer, encrypted)
-
-            # Decide to accept new proposal
-            if new_score > current_score or random.uniform(0, 1) < np.exp(
-                new_score - current_score
-            ):
-                current_cifer = new_cifer.copy()
-                current_score = new_score
-
-            if new_score > best_score:
-                best_score = new_score
-                best_cifer = new_cifer.copy()
-
-            # Print out progress
-            if i % 500 == 0 and verbose:
-                assert (
-                    type(verbose) is int and verbose > 0
-                ), "Select verbose=False or pass positive integer"
-
-                if i % verbose == 0:
-                    best_attempt_smpl = self.encrypt_or_decrypt(
-                        encrypted, {v: k for k, v in best_cifer.items()}
-                    )[:100]
-
-                    print(i, ":\t", best_attempt_smpl)
-
-        # Save best mapping
-        cipher_alphabet = "".join([k for k in sorted(best_cifer.keys())])
-        plaintext_alphabet = "".join([best_cifer[k] for k in cipher_alphabet])
-        mapping = dict(zip(plaintext_alphabet, cipher_alphabet))
-
-        decrypted_text = self.encrypt_or_decrypt(encrypted, mapping)
+        # Encode encrypted text once into alphabet indices
+        enc_idx = self.encode_text(encrypted)
+        bigram_counts = self.count_bigrams(enc_idx)
+
+        # Initialize every chain with its own random encrypted->plain permutation
+        n = len(self.alphabet)
+        perms = np.stack(
+            [self.rng.permutation(n).astype(np.int8) for _ in range(chains)]
+        )
+        current_scores = np.array(
+            [self.score_cipher(perm, enc_idx) for perm in perms]
+        )
+
+        best_perms, best_scores = perms.copy(), current_scores.copy()
+
+        # Validate verbose once, not per block
+        if verbose:
+            assert (
+                type(verbose) is int and verbose > 0
+            ), "Select verbose=False or pass positive integer"
+
+        # Run the jit-compiled parallel chains, in blocks of verbose
+        # iterations when progress should be printed out
+        done = 0
+        while done < iters:
+            if verbose:
+                best_perm = best_perms[best_scores.argmax()]
+                best_attempt_smpl = self.encrypt_or_decrypt(
+                    encrypted[:100], self.perm_to_mapping(best_perm)
+                )
+                print(done, ":\t", best_attempt_smpl)
+                block = min(verbose, iters - done)
+            else:
+                block = iters
+
+            seeds = self.rng.integers(0, 2**31, size=chains)
+            _mcmc_chains(
+                bigram_counts,
+                self.log_empirical_frequences,
+                perms,
+                best_perms,
+                current_scores,
+                best_scores,
+                block,
+                seeds,
+                proposals,
+            )
+            done += block
+
+        # Decrypt with the best permutation across all chains
+        best_perm = best_perms[best_scores.argmax()]
+        decrypted_text = self.encrypt_or_decrypt(
+            encrypted, self.perm_to_mapping(best_perm)
+        )
 
         return decrypted_text
 